@@ -3,15 +3,19 @@ FastAPI Sample Application for DevOps CI/CD Pipeline Demo
 """
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+import asyncio
 import os
 import logging
 import time
-from typing import Dict, Any, Optional, Union, cast
-import redis
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+import redis.asyncio as aioredis
+import asyncpg
 import json
+import orjson
 
 # Configure logging
 logging.basicConfig(
@@ -20,22 +24,18 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+APP_VERSION = "1.0.0"
+
 app = FastAPI(
     title="DevOps Demo API",
     description="Sample API for demonstrating GitOps CI/CD pipeline",
-    version="1.0.0"
-)
-
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    version=APP_VERSION,
+    default_response_class=ORJSONResponse
 )
 
 # Environment variables
+ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
+
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "redis_password")
@@ -45,6 +45,47 @@ POSTGRES_PORT = int(os.getenv("POSTGRES_PORT", "5432"))
 POSTGRES_DB = os.getenv("POSTGRES_DB", "interview_db")
 POSTGRES_USER = os.getenv("POSTGRES_USER", "interview_user")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "interview_password")
+# Pool bounds are per worker process: PostgreSQL max_connections (100 by
+# default) must cover replicas x WEB_CONCURRENCY x POSTGRES_POOL_MAX_SIZE.
+# Keep the idle floor low so many workers don't exhaust it at startup
+POSTGRES_POOL_MIN_SIZE = int(os.getenv("POSTGRES_POOL_MIN_SIZE", "1"))
+POSTGRES_POOL_MAX_SIZE = int(os.getenv("POSTGRES_POOL_MAX_SIZE", "25"))
+
+# Window for batching /counter increments; 0 sends one INCR per request
+COUNTER_BATCH_WINDOW = float(os.getenv("COUNTER_BATCH_WINDOW_MS", "5")) / 1000
+
+CORS_ALLOW_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv("CORS_ALLOW_ORIGINS", "*").split(",")
+    if origin.strip()
+]
+
+# CORS middleware; explicit lists keep per-request header handling cheap, and
+# credentials stay off since browsers reject them with a wildcard origin
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=CORS_ALLOW_ORIGINS,
+    allow_credentials=False,
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type", "Authorization"],
+)
+
+# Compress larger responses such as /users; small bodies are sent as-is
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# SQL statements
+INSERT_USER_SQL = (
+    "INSERT INTO users (name, email) VALUES ($1, $2) "
+    "RETURNING id, name, email, created_at"
+)
+LIST_USERS_SQL = (
+    "SELECT id, name, email, created_at FROM users "
+    "ORDER BY created_at DESC LIMIT 10"
+)
+EXPORT_USERS_SQL = (
+    "SELECT id, name, email, created_at FROM users "
+    "ORDER BY created_at DESC"
+)
 
 # Pydantic models
 class HealthResponse(BaseModel):
@@ -65,99 +106,236 @@ class UserResponse(BaseModel):
     id: int
     name: str
     email: str
-    created_at: str
+    created_at: datetime
+
+class UserBulkResponse(BaseModel):
+    created: int
+
+def get_redis_client() -> Optional[aioredis.Redis]:
+    """Get the Redis client created at startup"""
+    return getattr(app.state, "redis", None)
 
-# Global connections
-redis_client = None
-postgres_conn = None
+# Serializes lazy creation of the PostgreSQL pool
+_postgres_lock = asyncio.Lock()
+
+async def get_postgres_pool() -> Optional[asyncpg.Pool]:
+    """Get the PostgreSQL connection pool, creating it if not yet connected"""
+    pool = getattr(app.state, "pg", None)
+    if pool is not None:
+        return pool
+    
+    # Another request is already connecting; fail fast rather than queue
+    # behind it, so an unreachable database doesn't stack up timeouts
+    if _postgres_lock.locked():
+        return None
+    
+    async with _postgres_lock:
+        await init_postgres_pool()
+    return getattr(app.state, "pg", None)
 
-def get_redis_client() -> Optional[redis.Redis]:
-    """Get Redis client with connection handling"""
-    global redis_client
+class UserListLoader:
+    """Coalesce concurrent user-list reads into a single query"""
+    
+    def __init__(self, window: float = 0.005):
+        self.window = window
+        self._pending: Optional[asyncio.Task] = None
+    
+    async def load(self, pool: asyncpg.Pool) -> List[asyncpg.Record]:
+        """Join the in-flight query, or start one that later callers can join"""
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(self._fetch(pool))
+        # Shield so a cancelled caller doesn't cancel the query for the others
+        return await asyncio.shield(self._pending)
+    
+    async def _fetch(self, pool: asyncpg.Pool) -> List[asyncpg.Record]:
+        await asyncio.sleep(self.window)
+        # Close the window before querying so later callers, whose writes may
+        # not be in this snapshot, start a fresh query instead of joining it
+        self._pending = None
+        return await pool.fetch(LIST_USERS_SQL)
+
+user_list_loader = UserListLoader()
+
+class CounterBuffer:
+    """Batch concurrent counter increments into a single INCRBY"""
+    
+    def __init__(self, key: str, window: float = 0.005):
+        self.key = key
+        self.window = window
+        self._waiters: List[asyncio.Future] = []
+        self._flush_task: Optional[asyncio.Task] = None
+    
+    async def incr(self, redis_client: aioredis.Redis) -> int:
+        """Increment the counter and return this caller's own new value"""
+        if self.window <= 0:
+            return await redis_client.incr(self.key)
+        
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush(redis_client))
+        return await waiter
+    
+    async def _flush(self, redis_client: aioredis.Redis) -> None:
+        await asyncio.sleep(self.window)
+        waiters, self._waiters = self._waiters, []
+        self._flush_task = None
+        
+        try:
+            counter = await redis_client.incrby(self.key, len(waiters))
+        except Exception as e:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
+        
+        # Hand each waiter a distinct value from the range INCRBY just claimed
+        first = counter - len(waiters) + 1
+        for offset, waiter in enumerate(waiters):
+            if not waiter.done():
+                waiter.set_result(first + offset)
+
+counter_buffer = CounterBuffer("api_counter", window=COUNTER_BATCH_WINDOW)
+
+def create_redis_client() -> aioredis.Redis:
+    """Create a Redis client whose pool queues callers once it is exhausted"""
+    # The default pool raises "Too many connections" when all 50 are busy;
+    # the blocking pool makes bursts wait up to `timeout` for a free one
+    pool = aioredis.BlockingConnectionPool(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        password=REDIS_PASSWORD,
+        socket_connect_timeout=5,
+        socket_timeout=5,
+        max_connections=50,
+        timeout=5,
+        health_check_interval=30
+    )
+    return aioredis.Redis.from_pool(pool)
+
+async def init_redis_client() -> None:
+    """Create the shared Redis client and open its first connection"""
+    app.state.redis = create_redis_client()
     try:
-        if redis_client is None:
-            redis_client = redis.Redis(
-                host=REDIS_HOST,
-                port=REDIS_PORT,
-                password=REDIS_PASSWORD,
-                decode_responses=True,
-                socket_connect_timeout=5,
-                socket_timeout=5
-            )
-        redis_client.ping()
-        return redis_client
+        await app.state.redis.ping()
     except Exception as e:
+        # The pool reconnects on demand, so keep the client for later requests
         logger.error(f"Redis connection failed: {e}")
-        return None
 
-def get_postgres_connection() -> Optional[psycopg2.extensions.connection]:
-    """Get PostgreSQL connection with connection handling"""
-    global postgres_conn
+async def init_postgres_pool() -> None:
+    """Create the PostgreSQL connection pool and database tables"""
     try:
-        if postgres_conn is None or postgres_conn.closed:
-            postgres_conn = psycopg2.connect(
-                host=POSTGRES_HOST,
-                port=POSTGRES_PORT,
-                database=POSTGRES_DB,
-                user=POSTGRES_USER,
-                password=POSTGRES_PASSWORD,
-                cursor_factory=RealDictCursor
-            )
-        return postgres_conn
+        pool = await asyncpg.create_pool(
+            host=POSTGRES_HOST,
+            port=POSTGRES_PORT,
+            database=POSTGRES_DB,
+            user=POSTGRES_USER,
+            password=POSTGRES_PASSWORD,
+            min_size=POSTGRES_POOL_MIN_SIZE,
+            max_size=POSTGRES_POOL_MAX_SIZE,
+            # asyncpg caches prepared statements per connection, keyed by
+            # query text; raise the LRU from its default of 100 entries so
+            # the hot statements are never evicted as more queries are added
+            statement_cache_size=1024,
+            timeout=5
+        )
     except Exception as e:
         logger.error(f"PostgreSQL connection failed: {e}")
-        return None
+        return
+    
+    # Initialize PostgreSQL table
+    try:
+        await pool.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id SERIAL PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                email VARCHAR(100) UNIQUE NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        # Lets list_users read the newest rows from the index instead of sorting
+        await pool.execute(
+            "CREATE INDEX IF NOT EXISTS users_created_at_idx ON users (created_at DESC)"
+        )
+        logger.info("Database table initialized successfully")
+    except Exception as e:
+        # Drop the pool so the next request retries the whole initialization
+        logger.error(f"Database initialization failed: {e}")
+        await pool.close()
+        return
+    
+    app.state.pg = pool
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize database tables"""
+    """Initialize Redis client, database connection pool and tables"""
     logger.info("Starting up application...")
     
-    # Initialize PostgreSQL table
-    conn = get_postgres_connection()
-    if conn:
-        try:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS users (
-                        id SERIAL PRIMARY KEY,
-                        name VARCHAR(100) NOT NULL,
-                        email VARCHAR(100) UNIQUE NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                conn.commit()
-                logger.info("Database table initialized successfully")
-        except Exception as e:
-            logger.error(f"Database initialization failed: {e}")
+    # Connect to Redis and PostgreSQL concurrently
+    await asyncio.gather(init_redis_client(), get_postgres_pool())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close Redis client and database connection pool"""
+    redis_client = get_redis_client()
+    if redis_client:
+        await redis_client.aclose()
+    
+    pool = getattr(app.state, "pg", None)
+    if pool:
+        await pool.close()
 
 @app.get("/", response_model=Dict[str, str])
 async def root():
     """Root endpoint"""
     return {
         "message": "DevOps Demo API",
-        "version": "1.0.0",
+        "version": APP_VERSION,
         "docs": "/docs"
     }
 
-@app.get("/health", response_model=HealthResponse)
+# HealthResponse is only used for the OpenAPI schema; probes hit this path
+# constantly, so it returns a plain dict and skips Pydantic validation
+@app.get("/health", responses={200: {"model": HealthResponse}})
 async def health_check():
     """Health check endpoint for Kubernetes probes"""
-    return HealthResponse(
-        status="healthy",
-        timestamp=time.time(),
-        environment=os.getenv("ENVIRONMENT", "development"),
-        version="1.0.0"
-    )
+    return {
+        "status": "healthy",
+        "timestamp": time.time(),
+        "environment": ENVIRONMENT,
+        "version": APP_VERSION
+    }
+
+async def check_redis() -> bool:
+    """Ping Redis once"""
+    redis_client = get_redis_client()
+    if not redis_client:
+        return False
+    
+    try:
+        return await redis_client.ping()
+    except Exception as e:
+        logger.error(f"Redis connection failed: {e}")
+        return False
+
+async def check_postgres() -> bool:
+    """Run a trivial query against PostgreSQL once"""
+    pool = await get_postgres_pool()
+    if not pool:
+        return False
+    
+    try:
+        await asyncio.wait_for(pool.fetchval("SELECT 1"), timeout=5)
+        return True
+    except Exception as e:
+        logger.error(f"PostgreSQL connection failed: {e}")
+        return False
 
 @app.get("/ready")
 async def readiness_check():
     """Readiness check for Kubernetes"""
-    # Check Redis connectivity
-    redis_ok = get_redis_client() is not None
-    
-    # Check PostgreSQL connectivity
-    postgres_ok = get_postgres_connection() is not None
+    # Check Redis and PostgreSQL connectivity concurrently
+    redis_ok, postgres_ok = await asyncio.gather(check_redis(), check_postgres())
     
     if redis_ok and postgres_ok:
         return {"status": "ready", "redis": "ok", "postgres": "ok"}
@@ -179,14 +357,17 @@ async def get_counter():
         raise HTTPException(status_code=503, detail="Redis not available")
     
     try:
-        counter_value = redis_client.get("api_counter")
+        counter_value = await redis_client.get("api_counter")
         if counter_value is None:
             counter = 0
         else:
-            # Redis returns string when decode_responses=True, bytes otherwise
-            counter = int(str(counter_value))
+            # Replies are raw bytes, which int() parses directly
+            counter = int(counter_value)
         
         return CounterResponse(counter=counter, timestamp=time.time())
+    except (aioredis.ConnectionError, aioredis.TimeoutError) as e:
+        logger.error(f"Redis connection failed: {e}")
+        raise HTTPException(status_code=503, detail="Redis not available")
     except Exception as e:
         logger.error(f"Counter retrieval failed: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -199,9 +380,11 @@ async def increment_counter():
         raise HTTPException(status_code=503, detail="Redis not available")
     
     try:
-        counter_result = redis_client.incr("api_counter")
-        counter = int(str(counter_result))
+        counter = await counter_buffer.incr(redis_client)
         return CounterResponse(counter=counter, timestamp=time.time())
+    except (aioredis.ConnectionError, aioredis.TimeoutError) as e:
+        logger.error(f"Redis connection failed: {e}")
+        raise HTTPException(status_code=503, detail="Redis not available")
     except Exception as e:
         logger.error(f"Counter increment failed: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -209,92 +392,175 @@ async def increment_counter():
 @app.post("/users", response_model=UserResponse)
 async def create_user(user: UserCreate):
     """Create a new user in PostgreSQL"""
-    conn = get_postgres_connection()
-    if not conn:
+    pool = await get_postgres_pool()
+    if not pool:
         raise HTTPException(status_code=503, detail="Database not available")
     
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "INSERT INTO users (name, email) VALUES (%s, %s) RETURNING *",
-                (user.name, user.email)
-            )
-            new_user = cursor.fetchone()
-            conn.commit()
-            
-            if new_user is None:
-                raise Exception("Failed to create user")
-            
-            # Cast the RealDictRow to proper types
-            user_data = cast(Dict[str, Any], new_user)
-            return UserResponse(
-                id=int(user_data["id"]),
-                name=str(user_data["name"]),
-                email=str(user_data["email"]),
-                created_at=user_data["created_at"].isoformat()
-            )
-    except psycopg2.IntegrityError:
-        conn.rollback()
+        new_user = await pool.fetchrow(INSERT_USER_SQL, user.name, user.email)
+        
+        if new_user is None:
+            raise Exception("Failed to create user")
+        
+        return UserResponse(**new_user)
+    except asyncpg.UniqueViolationError:
         raise HTTPException(status_code=400, detail="Email already exists")
     except Exception as e:
-        conn.rollback()
         logger.error(f"User creation failed: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.post("/users/bulk", response_model=UserBulkResponse)
+async def create_users_bulk(users: List[UserCreate]):
+    """Create many users in PostgreSQL with a single COPY"""
+    pool = await get_postgres_pool()
+    if not pool:
+        raise HTTPException(status_code=503, detail="Database not available")
+    
+    if not users:
+        return UserBulkResponse(created=0)
+    
+    try:
+        async with pool.acquire() as con:
+            async with con.transaction():
+                await con.copy_records_to_table(
+                    "users",
+                    records=[(user.name, user.email) for user in users],
+                    columns=["name", "email"]
+                )
+        return UserBulkResponse(created=len(users))
+    except asyncpg.UniqueViolationError:
+        raise HTTPException(status_code=400, detail="Email already exists")
+    except Exception as e:
+        logger.error(f"Bulk user creation failed: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @app.get("/users")
 async def list_users():
     """List all users from PostgreSQL"""
-    conn = get_postgres_connection()
-    if not conn:
+    pool = await get_postgres_pool()
+    if not pool:
         raise HTTPException(status_code=503, detail="Database not available")
     
     try:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM users ORDER BY created_at DESC LIMIT 10")
-            users = cursor.fetchall()
-            
-            return {
-                "users": [
-                    {
-                        "id": int(cast(Dict[str, Any], user)["id"]),
-                        "name": str(cast(Dict[str, Any], user)["name"]),
-                        "email": str(cast(Dict[str, Any], user)["email"]),
-                        "created_at": cast(Dict[str, Any], user)["created_at"].isoformat()
-                    }
-                    for user in users
-                ]
-            }
+        users = await user_list_loader.load(pool)
+        
+        # Returning the response directly skips FastAPI's per-field
+        # jsonable_encoder pass; orjson encodes the row dicts natively
+        return ORJSONResponse({"users": [dict(user) for user in users]})
     except Exception as e:
         logger.error(f"User listing failed: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
-@app.get("/metrics")
+@app.get("/users/export")
+async def export_users():
+    """Stream every user from PostgreSQL as a single JSON document"""
+    pool = await get_postgres_pool()
+    if not pool:
+        raise HTTPException(status_code=503, detail="Database not available")
+    
+    async def generate():
+        # Rows are read through a server-side cursor and encoded one at a
+        # time, so memory stays flat however large the table grows
+        yield b'{"users":['
+        try:
+            async with pool.acquire() as con:
+                async with con.transaction():
+                    first = True
+                    async for user in con.cursor(EXPORT_USERS_SQL):
+                        yield (b"" if first else b",") + orjson.dumps(dict(user))
+                        first = False
+        except Exception as e:
+            # Headers are already sent, so the truncated body is all we can do
+            logger.error(f"User export failed: {e}")
+            raise
+        yield b"]}"
+    
+    return StreamingResponse(generate(), media_type="application/json")
+
+class PrometheusResponse(PlainTextResponse):
+    """Plain-text response using the Prometheus exposition content type"""
+    media_type = "text/plain; version=0.0.4"
+
+# Metrics cache: (monotonic timestamp, rendered body)
+METRICS_CACHE_TTL = 1.0
+_metrics_cache: Tuple[float, str] = (0.0, "")
+_metrics_lock = asyncio.Lock()
+
+async def fetch_counter_value() -> int:
+    """Read the API counter from Redis, defaulting to 0 when unavailable"""
+    redis_client = get_redis_client()
+    if not redis_client:
+        return 0
+    
+    try:
+        counter_value = await redis_client.get("api_counter")
+        if counter_value is not None:
+            return int(counter_value)
+    except Exception:
+        pass
+    return 0
+
+async def fetch_user_count() -> Optional[int]:
+    """Count users in PostgreSQL, or None when it is unavailable"""
+    # Use the pool only if it already exists: connecting here would hold
+    # _metrics_lock, and every other scraper, for the whole connect timeout
+    pool = getattr(app.state, "pg", None)
+    if not pool:
+        return None
+    
+    try:
+        return await pool.fetchval("SELECT count(*) FROM users")
+    except Exception:
+        return None
+
+@app.get("/metrics", response_class=PrometheusResponse)
 async def get_metrics():
     """Basic metrics endpoint for Prometheus scraping"""
-    redis_client = get_redis_client()
+    global _metrics_cache
     
-    # Get counter value
-    counter = 0
-    if redis_client:
-        try:
-            counter_value = redis_client.get("api_counter")
-            if counter_value is not None:
-                counter = int(str(counter_value))
-        except:
-            pass
+    # Serve the cached body while fresh so concurrent scrapers share one refresh
+    cached_at, metrics = _metrics_cache
+    if metrics and time.monotonic() - cached_at < METRICS_CACHE_TTL:
+        return metrics
     
-    # Simple metrics format
-    metrics = f"""# HELP api_counter_total Total API counter value
+    async with _metrics_lock:
+        # Another request may have refreshed the cache while we waited
+        cached_at, metrics = _metrics_cache
+        if metrics and time.monotonic() - cached_at < METRICS_CACHE_TTL:
+            return metrics
+        
+        # Query Redis and PostgreSQL concurrently so the scrape costs one round-trip
+        counter, users = await asyncio.gather(fetch_counter_value(), fetch_user_count())
+        
+        # Omit the user sample when PostgreSQL is down rather than report 0
+        users_sample = f"api_users_total {users}\n" if users is not None else ""
+        
+        # Simple metrics format
+        metrics = f"""# HELP api_counter_total Total API counter value
 # TYPE api_counter_total counter
 api_counter_total {counter}
 
+# HELP api_users_total Number of registered users
+# TYPE api_users_total gauge
+{users_sample}
 # HELP api_health Application health status
 # TYPE api_health gauge
 api_health 1
 """
+        _metrics_cache = (time.monotonic(), metrics)
     
     return metrics
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # One worker per core by default; workers accept on one listening socket
+    # inherited from the parent and each opens its own Redis client and
+    # PostgreSQL pool
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+    )
\ No newline at end of file
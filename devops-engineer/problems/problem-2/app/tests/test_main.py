@@ -17,7 +17,7 @@ from httpx import AsyncClient
 from fastapi.testclient import TestClient
 
 try:
-    from main import app  # type: ignore
+    from main import app, CounterBuffer, UserListLoader  # type: ignore
 except ImportError:
     # Fallback import method
     import importlib.util
@@ -26,6 +26,8 @@ except ImportError:
         main_module = importlib.util.module_from_spec(spec)
         spec.loader.exec_module(main_module)
         app = main_module.app
+        CounterBuffer = main_module.CounterBuffer
+        UserListLoader = main_module.UserListLoader
     else:
         raise ImportError("Could not import main module")
 
@@ -60,8 +62,11 @@ class TestAPI:
         """Test the metrics endpoint"""
         response = await client.get("/metrics")
         assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
         content = response.text
+        assert content.startswith("# HELP")
         assert "api_counter_total" in content
+        assert "api_users_total" in content
         assert "api_health" in content
     
     async def test_counter_get_initial(self, client: AsyncClient):
@@ -89,9 +94,17 @@ class TestAPI:
         # Should either succeed or fail with 503 (service unavailable)
         assert response.status_code in [200, 201, 400, 503]
         
+        # Test bulk user creation endpoint
+        response = await client.post("/users/bulk", json=[user_data])
+        assert response.status_code in [200, 400, 503]
+        
         # Test user listing endpoint
         response = await client.get("/users")
         assert response.status_code in [200, 503]
+        
+        # Test streaming user export endpoint
+        response = await client.get("/users/export")
+        assert response.status_code in [200, 503]
 
 class TestHealthChecks:
     
@@ -101,5 +114,328 @@ class TestHealthChecks:
         # This will likely fail without Redis/PostgreSQL, which is expected
         assert response.status_code in [200, 503]
 
+class TestPostgresPool:
+    
+    async def test_pool_is_created_once_database_comes_up(self, monkeypatch):
+        """Test a failed startup connection is retried on a later request"""
+        import main  # type: ignore
+        
+        class FakePool:
+            async def execute(self, query):
+                return None
+        
+        attempts = []
+        
+        async def fake_create_pool(**kwargs):
+            attempts.append(kwargs)
+            if len(attempts) == 1:
+                raise OSError("connection refused")
+            return FakePool()
+        
+        monkeypatch.setattr(main.asyncpg, "create_pool", fake_create_pool)
+        
+        try:
+            assert await main.get_postgres_pool() is None
+            pool = await main.get_postgres_pool()
+            assert isinstance(pool, FakePool)
+            assert await main.get_postgres_pool() is pool
+            assert len(attempts) == 2
+        finally:
+            main.app.state.pg = None
+
+class TestMetrics:
+    
+    async def test_user_sample_omitted_when_database_fails(self, client, monkeypatch):
+        """Test a failing user count drops the sample instead of reporting 0"""
+        import main  # type: ignore
+        
+        class FakePool:
+            def __init__(self, result):
+                self.result = result
+            
+            async def fetchval(self, query):
+                if isinstance(self.result, Exception):
+                    raise self.result
+                return self.result
+        
+        monkeypatch.setattr(main, "_metrics_cache", (0.0, ""))
+        monkeypatch.setattr(main, "METRICS_CACHE_TTL", 0.0)
+        try:
+            main.app.state.pg = FakePool(OSError("connection refused"))
+            content = (await client.get("/metrics")).text
+            assert "# TYPE api_users_total gauge" in content
+            assert "\napi_users_total " not in content
+            
+            main.app.state.pg = FakePool(3)
+            content = (await client.get("/metrics")).text
+            assert "\napi_users_total 3\n" in content
+        finally:
+            main.app.state.pg = None
+
+    async def test_metrics_cached_within_ttl(self, client, monkeypatch):
+        """Test concurrent scrapes share one refresh until the TTL expires"""
+        import main  # type: ignore
+        
+        calls = {"counter": 0, "users": 0}
+        
+        async def fake_counter():
+            calls["counter"] += 1
+            # Slow enough that the other scrapers queue on _metrics_lock
+            await asyncio.sleep(0.02)
+            return calls["counter"]
+        
+        async def fake_users():
+            calls["users"] += 1
+            return 7
+        
+        monkeypatch.setattr(main, "fetch_counter_value", fake_counter)
+        monkeypatch.setattr(main, "fetch_user_count", fake_users)
+        monkeypatch.setattr(main, "_metrics_cache", (0.0, ""))
+        monkeypatch.setattr(main, "METRICS_CACHE_TTL", 0.2)
+        
+        responses = await asyncio.gather(*(client.get("/metrics") for _ in range(5)))
+        assert calls == {"counter": 1, "users": 1}
+        assert all("api_counter_total 1\n" in response.text for response in responses)
+        
+        # Still fresh: served from the cache
+        await client.get("/metrics")
+        assert calls == {"counter": 1, "users": 1}
+        
+        # Expired: the next scrape refreshes
+        await asyncio.sleep(0.25)
+        response = await client.get("/metrics")
+        assert calls == {"counter": 2, "users": 2}
+        assert "api_counter_total 2\n" in response.text
+
+class TestRedisClient:
+    
+    async def test_bursts_beyond_pool_size_wait_for_a_connection(self, client, monkeypatch):
+        """Test more concurrent /counter reads than pooled connections all succeed"""
+        import main  # type: ignore
+        
+        open_connections = 0
+        peak_connections = 0
+        
+        async def handle(reader, writer):
+            # Minimal RESP server: +OK for setup commands, a slow GET reply
+            nonlocal open_connections, peak_connections
+            open_connections += 1
+            peak_connections = max(peak_connections, open_connections)
+            try:
+                while True:
+                    header = await reader.readline()
+                    if not header:
+                        break
+                    args = []
+                    for _ in range(int(header[1:])):
+                        length = int((await reader.readline())[1:])
+                        args.append((await reader.readexactly(length + 2))[:-2])
+                    if args[0].upper() == b"GET":
+                        await asyncio.sleep(0.05)
+                        writer.write(b"$2\r\n42\r\n")
+                    else:
+                        writer.write(b"+OK\r\n")
+                    await writer.drain()
+            finally:
+                open_connections -= 1
+                writer.close()
+        
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        monkeypatch.setattr(main, "REDIS_HOST", "127.0.0.1")
+        monkeypatch.setattr(main, "REDIS_PORT", server.sockets[0].getsockname()[1])
+        main.app.state.redis = main.create_redis_client()
+        
+        try:
+            responses = await asyncio.gather(*(client.get("/counter") for _ in range(100)))
+            assert [response.status_code for response in responses] == [200] * 100
+            assert all(response.json()["counter"] == 42 for response in responses)
+            assert peak_connections <= 50
+        finally:
+            await main.app.state.redis.aclose()
+            main.app.state.redis = None
+            server.close()
+            await server.wait_closed()
+
+class TestUsersBulk:
+    
+    @staticmethod
+    def make_pool(copies, error=None):
+        """Fake pool recording copy_records_to_table calls into `copies`"""
+        from contextlib import asynccontextmanager
+        
+        class FakeConnection:
+            def transaction(self):
+                @asynccontextmanager
+                async def transaction():
+                    yield
+                return transaction()
+            
+            async def copy_records_to_table(self, table, records, columns):
+                if error is not None:
+                    raise error
+                copies.append((table, records, columns))
+        
+        class FakePool:
+            @asynccontextmanager
+            async def acquire(self):
+                yield FakeConnection()
+        
+        return FakePool()
+    
+    async def test_bulk_copies_name_email_tuples(self, client):
+        """Test bulk creation sends (name, email) tuples in one COPY"""
+        import main  # type: ignore
+        
+        copies = []
+        users = [
+            {"name": "Ada", "email": "ada@example.com"},
+            {"name": "Bob", "email": "bob@example.com"}
+        ]
+        main.app.state.pg = self.make_pool(copies)
+        try:
+            response = await client.post("/users/bulk", json=users)
+        finally:
+            main.app.state.pg = None
+        
+        assert response.status_code == 200
+        assert response.json() == {"created": 2}
+        assert copies == [(
+            "users",
+            [("Ada", "ada@example.com"), ("Bob", "bob@example.com")],
+            ["name", "email"]
+        )]
+    
+    async def test_bulk_duplicate_email_returns_400(self, client):
+        """Test a unique violation during COPY maps to 400"""
+        import asyncpg
+        import main  # type: ignore
+        
+        main.app.state.pg = self.make_pool([], error=asyncpg.UniqueViolationError("duplicate"))
+        try:
+            response = await client.post(
+                "/users/bulk", json=[{"name": "Ada", "email": "ada@example.com"}]
+            )
+        finally:
+            main.app.state.pg = None
+        
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Email already exists"
+
+class TestUserExport:
+    
+    @staticmethod
+    def make_pool(rows):
+        """Fake pool whose connection streams `rows` from a cursor"""
+        from contextlib import asynccontextmanager
+        
+        class FakeConnection:
+            def transaction(self):
+                @asynccontextmanager
+                async def transaction():
+                    yield
+                return transaction()
+            
+            async def cursor(self, query):
+                for row in rows:
+                    yield row
+        
+        class FakePool:
+            @asynccontextmanager
+            async def acquire(self):
+                yield FakeConnection()
+        
+        return FakePool()
+    
+    @pytest.mark.parametrize("count", [0, 1, 3])
+    async def test_export_streams_valid_json(self, client, count):
+        """Test the hand-built JSON framing for empty and multi-row tables"""
+        import json
+        from datetime import datetime
+        import main  # type: ignore
+        
+        rows = [
+            {
+                "id": i,
+                "name": f"User {i}",
+                "email": f"user{i}@example.com",
+                "created_at": datetime(2024, 1, 1, 12, 0, i)
+            }
+            for i in range(count)
+        ]
+        main.app.state.pg = self.make_pool(rows)
+        try:
+            response = await client.get("/users/export")
+        finally:
+            main.app.state.pg = None
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        users = json.loads(response.content)["users"]
+        assert [user["id"] for user in users] == list(range(count))
+        assert all(user["created_at"].startswith("2024-01-01T12:00:0") for user in users)
+
+class TestUserListLoader:
+    
+    async def test_concurrent_loads_share_one_query(self):
+        """Test concurrent user-list reads are coalesced into one query"""
+        class FakePool:
+            calls = 0
+            
+            async def fetch(self, query):
+                FakePool.calls += 1
+                return [{"id": 1}]
+        
+        loader = UserListLoader(window=0.01)
+        pool = FakePool()
+        results = await asyncio.gather(*(loader.load(pool) for _ in range(5)))
+        
+        assert FakePool.calls == 1
+        assert all(result == [{"id": 1}] for result in results)
+        
+        # A read after the window closes issues a fresh query
+        await loader.load(pool)
+        assert FakePool.calls == 2
+    
+    async def test_load_during_fetch_starts_new_query(self):
+        """Test a read arriving while the query runs doesn't join it"""
+        class SlowPool:
+            calls = 0
+            
+            async def fetch(self, query):
+                SlowPool.calls += 1
+                snapshot = SlowPool.calls
+                await asyncio.sleep(0.05)
+                return [{"snapshot": snapshot}]
+        
+        loader = UserListLoader(window=0.01)
+        pool = SlowPool()
+        first = asyncio.ensure_future(loader.load(pool))
+        # Arrive after the window has closed but before the first fetch returns
+        await asyncio.sleep(0.03)
+        second = await loader.load(pool)
+        
+        assert SlowPool.calls == 2
+        assert (await first) == [{"snapshot": 1}]
+        assert second == [{"snapshot": 2}]
+
+class TestCounterBuffer:
+    
+    async def test_concurrent_increments_share_one_incrby(self):
+        """Test concurrent increments are flushed as one INCRBY"""
+        class FakeRedis:
+            value = 0
+            calls = 0
+            
+            async def incrby(self, key, amount):
+                FakeRedis.calls += 1
+                FakeRedis.value += amount
+                return FakeRedis.value
+        
+        buffer = CounterBuffer("api_counter", window=0.01)
+        results = await asyncio.gather(*(buffer.incr(FakeRedis()) for _ in range(5)))
+        
+        assert FakeRedis.calls == 1
+        assert sorted(results) == [1, 2, 3, 4, 5]
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
\ No newline at end of file
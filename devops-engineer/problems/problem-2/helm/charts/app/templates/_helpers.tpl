@@ -81,6 +81,10 @@ Create environment variables
 {{- define "devops-demo-app.envVars" -}}
 - name: ENVIRONMENT
   value: {{ .Values.environment | quote }}
+- name: WEB_CONCURRENCY
+  value: {{ .Values.app.workers | quote }}
+- name: CORS_ALLOW_ORIGINS
+  value: {{ .Values.app.corsAllowOrigins | quote }}
 - name: REDIS_HOST
   value: {{ .Values.cache.redis.host | quote }}
 - name: REDIS_PORT
@@ -96,6 +100,10 @@ Create environment variables
   value: {{ .Values.database.postgres.port | quote }}
 - name: POSTGRES_DB
   value: {{ .Values.database.postgres.database | quote }}
+- name: POSTGRES_POOL_MIN_SIZE
+  value: {{ .Values.database.postgres.poolMinSize | quote }}
+- name: POSTGRES_POOL_MAX_SIZE
+  value: {{ .Values.database.postgres.poolMaxSize | quote }}
 - name: POSTGRES_USER
   valueFrom:
     secretKeyRef: